@@ -0,0 +1,270 @@
+import math
+from typing import Dict, Iterable, List, Tuple, Union
+
+# Relative accuracy of the quantiles returned by the sketch
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Quantiles reported in the summary records
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+# Sketch bin holding the values <= 0
+ZERO_BIN = "zero"
+# Decimals kept for the reported durations, in minutes
+SUMMARY_DECIMALS = 3
+# Layout of the per-key rows in a summary record
+SUMMARY_FIELDS = (
+    ["count", "sum", "mean"]
+    + [f"p{round(q * 100)}" for q in SUMMARY_QUANTILES]
+    + ["sketch"]
+)
+
+
+class QuantileSketch:
+    """A DDSketch-style quantile sketch. Positive values are stored in
+    logarithmically spaced bins, so every quantile is returned with a
+    bounded relative error. Two sketches with the same accuracy are
+    merged by adding their bin counts, which makes them safe to combine
+    across shards and Lambda invocations.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        """Add a value to the sketch
+
+        Args:
+            value (float): The value to add
+        """
+        self.count += 1
+        if value <= 0:
+            # Durations should never be negative, keep them with the zeros
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other: "QuantileSketch"):
+        """Merge another sketch into this one
+
+        Args:
+            other (QuantileSketch): Sketch with the same relative accuracy
+
+        Raises:
+            ValueError: If the sketches have different relative accuracies
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Union[float, None]:
+        """Estimate a quantile
+
+        Args:
+            q (float): The quantile, between 0 and 1
+
+        Returns:
+            Union[float, None]: The estimate, or None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict[str, int]:
+        """Compact, JSON serialisable form of the sketch. The relative
+        accuracy is not included, it is stored once per summary record.
+        """
+        bins = {str(index): count for index, count in self.bins.items()}
+        if self.zero_count:
+            bins[ZERO_BIN] = self.zero_count
+        return bins
+
+    @classmethod
+    def from_dict(
+        cls, bins: Dict[str, int], relative_accuracy: float
+    ) -> "QuantileSketch":
+        """Rebuild a sketch from the output of to_dict"""
+        sketch = cls(relative_accuracy)
+        sketch.zero_count = bins.get(ZERO_BIN, 0)
+        sketch.bins = {
+            int(index): count for index, count in bins.items() if index != ZERO_BIN
+        }
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+class RunningStats:
+    """Count, mean and quantile sketch of the predicted durations
+    for one group in one window.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.total = 0.0
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    @property
+    def count(self) -> int:
+        return self.sketch.count
+
+    @property
+    def mean(self) -> Union[float, None]:
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def add(self, value: float):
+        self.total += value
+        self.sketch.add(value)
+
+    def merge(self, other: "RunningStats"):
+        self.total += other.total
+        self.sketch.merge(other.sketch)
+
+
+# The summaries are grouped by (group, window_start)
+WindowKey = Tuple[str, int]
+
+
+class WindowedAggregator:
+    """Keeps running statistics of the predicted durations per pick-up
+    zone ("PU") and per pick-up/drop-off pair ("PU_DO") over tumbling
+    windows, based on the arrival time of the records.
+
+    Each invocation only summarises the records it has seen, the emitted
+    summaries are partial and are combined downstream with merge_summaries.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = 60,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    ):
+        self.window_seconds = window_seconds
+        self.relative_accuracy = relative_accuracy
+        self.stats: Dict[WindowKey, Dict[str, RunningStats]] = {}
+
+    def add(
+        self, ride: Dict[str, Union[str, float]], duration: float, timestamp: float
+    ):
+        """Add a prediction to the windows it belongs to
+
+        Args:
+            ride (Dict[str, Union[str, float]]): The input ride
+            duration (float): The predicted duration, in minutes
+            timestamp (float): Arrival time of the record, in epoch seconds
+        """
+        window_start = int(timestamp // self.window_seconds) * self.window_seconds
+        pickup = str(ride["PULocationID"])
+        pair = "%s_%s" % (ride["PULocationID"], ride["DOLocationID"])
+        for group, key in (("PU", pickup), ("PU_DO", pair)):
+            window = self.stats.setdefault((group, window_start), {})
+            if key not in window:
+                window[key] = RunningStats(self.relative_accuracy)
+            window[key].add(duration)
+
+    def summaries(self) -> List[Dict]:
+        """Summary records for every window seen so far
+
+        Returns:
+            List[Dict]: One record per group and window
+        """
+        return [
+            make_summary(window_key, stats, self.window_seconds, self.relative_accuracy)
+            for window_key, stats in self.stats.items()
+        ]
+
+
+def make_summary(
+    window_key: WindowKey,
+    stats: Dict[str, RunningStats],
+    window_seconds: int,
+    relative_accuracy: float,
+) -> Dict:
+    """Create a compact summary record, holding the statistics of
+    every key of a group in one window. The statistics of each key
+    are stored as a row laid out as in SUMMARY_FIELDS.
+
+    Args:
+        window_key (WindowKey): The group and start of the window
+        stats (Dict[str, RunningStats]): The statistics of each key
+        window_seconds (int): Length of the window
+        relative_accuracy (float): Relative accuracy of the sketches
+
+    Returns:
+        Dict: The summary record
+    """
+    group, window_start = window_key
+    return {
+        "group": group,
+        "window_start": window_start,
+        "window_end": window_start + window_seconds,
+        "relative_accuracy": relative_accuracy,
+        "fields": SUMMARY_FIELDS,
+        "stats": {
+            key: [
+                key_stats.count,
+                # Keep enough precision for the merged means
+                round(key_stats.total, 2 * SUMMARY_DECIMALS),
+                round(key_stats.mean, SUMMARY_DECIMALS),
+            ]
+            + [
+                round(key_stats.sketch.quantile(q), SUMMARY_DECIMALS)
+                for q in SUMMARY_QUANTILES
+            ]
+            + [key_stats.sketch.to_dict()]
+            for key, key_stats in stats.items()
+        },
+    }
+
+
+def merge_summaries(summaries: Iterable[Dict]) -> List[Dict]:
+    """Merge summary records coming from different shards or invocations.
+    Records for the same group and window are combined key by key, and
+    the means and quantiles are recomputed from the merged statistics.
+
+    Args:
+        summaries (Iterable[Dict]): Summary records, as made by make_summary
+
+    Returns:
+        List[Dict]: One merged record per group and window
+    """
+    merged: Dict[WindowKey, Dict[str, RunningStats]] = {}
+    windows: Dict[WindowKey, Tuple[int, float]] = {}
+    for summary in summaries:
+        window_key = (summary["group"], summary["window_start"])
+        relative_accuracy = summary["relative_accuracy"]
+        window = merged.setdefault(window_key, {})
+        windows.setdefault(
+            window_key,
+            (summary["window_end"] - summary["window_start"], relative_accuracy),
+        )
+        fields = summary["fields"]
+        for key, row in summary["stats"].items():
+            key_summary = dict(zip(fields, row))
+            stats = RunningStats(relative_accuracy)
+            stats.total = key_summary["sum"]
+            stats.sketch = QuantileSketch.from_dict(
+                key_summary["sketch"], relative_accuracy
+            )
+            if key in window:
+                window[key].merge(stats)
+            else:
+                window[key] = stats
+    return [
+        make_summary(window_key, stats, *windows[window_key])
+        for window_key, stats in merged.items()
+    ]
@@ -1,10 +1,11 @@
 import base64
 import json
 import os
-from typing import Dict, Union
+import time
+from typing import Dict, List, Union
 
 import boto3
-import mlflow
+from aggregation import WindowedAggregator
 
 kinesis_client = boto3.client("kinesis")
 # The output stream name
@@ -12,11 +13,29 @@ PREDICTIONS_STREAM_NAME = os.getenv("PREDICTIONS_STREAM_NAME", "ride_predictions
 
 # This should be an artifact that was stored by MLflow
 logged_model = os.getenv("LOGGED_MODEL")
-model = mlflow.pyfunc.load_model(logged_model)
+# The slim image serves the "compact_model" artifact instead,
+# which only needs numpy (see model_training/compact_model.py)
+compact_model_uri = os.getenv("COMPACT_MODEL")
+if compact_model_uri:
+    from compact_model import load_model
+
+    model = load_model(compact_model_uri)
+else:
+    import mlflow
+
+    model = mlflow.pyfunc.load_model(logged_model)
 
 # For running locally, without sending a stream
 TEST_RUN = os.getenv("TEST_RUN", "False") == "True"
 
+# Optionally emit windowed per-zone summaries alongside the predictions
+AGGREGATE = os.getenv("AGGREGATE", "False") == "True"
+AGGREGATION_WINDOW_SECONDS = int(os.getenv("AGGREGATION_WINDOW_SECONDS", "60"))
+# Maximum number of records accepted by a single put_records call
+PUT_RECORDS_BATCH_SIZE = 500
+# Attempts to send records rejected by put_records, e.g. when throttled
+PUT_RECORDS_MAX_ATTEMPTS = 3
+
 
 def prepare_features(
     ride: Dict[str, Union[str, float]]
@@ -52,9 +71,44 @@ def predict(features: Dict[str, Union[str, float]]) -> float:
     return float(pred[0])
 
 
+def put_records(records: List[Dict[str, str]]):
+    """Send records to the output stream with put_records. Unlike
+    put_record, put_records does not raise when some records are
+    rejected, so the failed ones are resent a few times.
+
+    Args:
+        records (List[Dict[str, str]]): Records with Data and PartitionKey
+
+    Raises:
+        RuntimeError: If some records are still rejected after all attempts,
+                      so that Lambda retries the batch
+    """
+    for attempt in range(PUT_RECORDS_MAX_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(0.1 * 2**attempt)
+        response = kinesis_client.put_records(
+            StreamName=PREDICTIONS_STREAM_NAME, Records=records
+        )
+        if response["FailedRecordCount"] == 0:
+            return
+        # The results are in the same order as the records
+        failed = [
+            (record, result)
+            for record, result in zip(records, response["Records"])
+            if "ErrorCode" in result
+        ]
+        records = [record for record, _ in failed]
+    errors = sorted({result["ErrorCode"] for _, result in failed})
+    raise RuntimeError(
+        f"Failed to put {len(records)} records to {PREDICTIONS_STREAM_NAME}: {errors}"
+    )
+
+
 def lambda_handler(event, context):
 
     predictions_events = []
+    if AGGREGATE:
+        aggregator = WindowedAggregator(AGGREGATION_WINDOW_SECONDS)
 
     # Iterate over every input
     for record in event["Records"]:
@@ -86,4 +140,38 @@ def lambda_handler(event, context):
 
         predictions_events.append(prediction_event)
 
-    return {"predictions": predictions_events}
+        if AGGREGATE:
+            timestamp = record["kinesis"].get(
+                "approximateArrivalTimestamp", time.time()
+            )
+            aggregator.add(ride, prediction, timestamp)
+
+    if not AGGREGATE:
+        return {"predictions": predictions_events}
+
+    summary_events = [
+        {
+            "model": "ride_duration_prediction_model",
+            "version": "123",
+            "summary": summary,
+        }
+        for summary in aggregator.summaries()
+    ]
+
+    # Send the summaries in as few requests as possible
+    if not TEST_RUN:
+        records = [
+            {
+                "Data": json.dumps(summary_event),
+                "PartitionKey": "%s:%s"
+                % (
+                    summary_event["summary"]["group"],
+                    summary_event["summary"]["window_start"],
+                ),
+            }
+            for summary_event in summary_events
+        ]
+        for i in range(0, len(records), PUT_RECORDS_BATCH_SIZE):
+            put_records(records[i : i + PUT_RECORDS_BATCH_SIZE])
+
+    return {"predictions": predictions_events, "summaries": summary_events}
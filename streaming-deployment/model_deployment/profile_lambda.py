@@ -0,0 +1,253 @@
+import base64
+import importlib
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import typer
+import yaml
+from rich.logging import RichHandler
+from rich.traceback import install
+from typing_extensions import Annotated
+
+# Sets up the logger to work with rich
+logger = logging.getLogger(__name__)
+logger.addHandler(RichHandler(rich_tracebacks=True, markup=True))
+logger.setLevel("INFO")
+# Setup rich to get nice tracebacks
+install()
+
+DOCKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docker")
+# Holds the numpy-only runtime used by the slim image
+TRAINING_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"
+)
+
+# Limits imposed by AWS Lambda
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+MIN_TIMEOUT_S = 3
+MAX_TIMEOUT_S = 900
+
+# The NYC taxi zones are numbered 1-265
+N_ZONES = 265
+
+# Config keys used by the different IaC variants
+OUTPUT_FORMATS = {
+    "pulumi": ("streaming_model:memory_size", "streaming_model:timeout"),
+    "pulumi-autogen": ("model_deployment_tf:memorySize", "model_deployment_tf:timeout"),
+    "tfvars": ("lambda_memory_size", "lambda_timeout"),
+}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far
+
+    Returns:
+        float: The peak RSS, in MiB
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS but in KiB on Linux
+    if sys.platform == "darwin":
+        return maxrss / 1024**2
+    return maxrss / 1024
+
+
+def make_batch(
+    rng: np.random.Generator, batch_size: int, first_ride_id: int
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Create a synthetic Kinesis event, shaped like the ones
+    Lambda receives from the input stream.
+
+    Args:
+        rng (np.random.Generator): Random number generator
+        batch_size (int): Number of records in the event
+        first_ride_id (int): ride_id of the first record
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: The event
+    """
+    records = []
+    pickups = rng.integers(1, N_ZONES + 1, size=batch_size)
+    dropoffs = rng.integers(1, N_ZONES + 1, size=batch_size)
+    # Most trips are short, with a long tail
+    distances = np.round(rng.lognormal(mean=0.7, sigma=0.8, size=batch_size), 2)
+    for i in range(batch_size):
+        ride_id = first_ride_id + i
+        ride_event = {
+            "ride": {
+                "PULocationID": int(pickups[i]),
+                "DOLocationID": int(dropoffs[i]),
+                "trip_distance": float(distances[i]),
+            },
+            "ride_id": ride_id,
+        }
+        data = base64.b64encode(json.dumps(ride_event).encode("utf-8"))
+        records.append(
+            {
+                "kinesis": {
+                    "kinesisSchemaVersion": "1.0",
+                    "partitionKey": str(ride_id),
+                    "data": data.decode("utf-8"),
+                },
+                "eventSource": "aws:kinesis",
+                "eventName": "aws:kinesis:record",
+            }
+        )
+    return {"Records": records}
+
+
+def suggest_memory(peak_mb: float, headroom: float) -> int:
+    """Suggest a Lambda memory size from the measured peak RSS.
+    Rounded up to a multiple of 64 MiB.
+
+    Args:
+        peak_mb (float): Measured peak RSS, in MiB
+        headroom (float): Fractional headroom to add on top
+
+    Returns:
+        int: Memory size, in MiB
+    """
+    memory = math.ceil(peak_mb * (1 + headroom) / 64) * 64
+    return int(min(max(memory, MIN_MEMORY_MB), MAX_MEMORY_MB))
+
+
+def suggest_timeout(
+    worst_batch_s: float, load_time_s: float, safety_factor: float
+) -> int:
+    """Suggest a Lambda timeout. The worst batch latency is scaled
+    by the safety factor, since Lambda CPUs are usually slower
+    than the local machine, and the model load time is added to
+    cover cold starts.
+
+    Args:
+        worst_batch_s (float): Slowest measured batch, in seconds
+        load_time_s (float): Time to load the model, in seconds
+        safety_factor (float): Multiplier for the batch latency
+
+    Returns:
+        int: Timeout, in seconds
+    """
+    timeout = math.ceil(worst_batch_s * safety_factor + load_time_s)
+    return int(min(max(timeout, MIN_TIMEOUT_S), MAX_TIMEOUT_S))
+
+
+def write_settings(
+    memory_size: int, timeout: int, output_format: str, output_file: str
+):
+    """Write the suggested settings in a form the IaC tools can consume.
+    Pulumi stack files are updated in place, so any existing config
+    is kept.
+
+    Args:
+        memory_size (int): Memory size, in MiB
+        timeout (int): Timeout, in seconds
+        output_format (str): One of the keys of OUTPUT_FORMATS
+        output_file (str): File to write to
+    """
+    memory_key, timeout_key = OUTPUT_FORMATS[output_format]
+    if output_format == "tfvars":
+        with open(output_file, "w") as fw:
+            fw.write(f"{memory_key} = {memory_size}\n")
+            fw.write(f"{timeout_key} = {timeout}\n")
+        return
+
+    stack = {}
+    if os.path.exists(output_file):
+        with open(output_file) as stream:
+            stack = yaml.safe_load(stream) or {}
+    stack.setdefault("config", {})
+    stack["config"][memory_key] = str(memory_size)
+    stack["config"][timeout_key] = str(timeout)
+    with open(output_file, "w") as fw:
+        yaml.safe_dump(stack, fw, default_flow_style=False)
+
+
+def main(
+    logged_model: Annotated[
+        str, typer.Option(help="The MLflow model URI, as passed to the Lambda")
+    ] = None,
+    compact_model: Annotated[
+        str,
+        typer.Option(help="The compact model URI, to profile the slim image"),
+    ] = None,
+    output_format: Annotated[
+        str, typer.Option(help=f"One of {list(OUTPUT_FORMATS)}")
+    ] = "tfvars",
+    output_file: Annotated[
+        str, typer.Option(help="File to write the suggested settings to")
+    ] = "lambda_sizing.tfvars",
+    batch_size: Annotated[
+        int, typer.Option(help="Records per Kinesis batch (Lambda default is 100)")
+    ] = 100,
+    n_batches: Annotated[int, typer.Option(help="Number of batches to replay")] = 50,
+    memory_headroom: Annotated[
+        float, typer.Option(help="Fractional headroom on top of the peak RSS")
+    ] = 0.25,
+    timeout_factor: Annotated[
+        float, typer.Option(help="Multiplier for the slowest batch latency")
+    ] = 3.0,
+    seed: Annotated[int, typer.Option(help="Seed for the synthetic rides")] = 42,
+):
+    """Profile the Lambda handler locally and suggest memory and timeout
+    settings for the Lambda function.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}")
+    if (logged_model is None) == (compact_model is None):
+        raise ValueError("Exactly one of logged_model or compact_model is needed")
+
+    # The handler reads its configuration at import time
+    if compact_model is not None:
+        os.environ["COMPACT_MODEL"] = compact_model
+        sys.path.insert(0, TRAINING_DIR)
+    else:
+        os.environ["LOGGED_MODEL"] = logged_model
+        # Make sure the full model is profiled
+        os.environ.pop("COMPACT_MODEL", None)
+    os.environ["TEST_RUN"] = "True"
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, DOCKER_DIR)
+
+    baseline_mb = peak_rss_mb()
+    logger.info(f"Loading model from {compact_model or logged_model}")
+    start = time.perf_counter()
+    lambda_function = importlib.import_module("lambda_function")
+    load_time_s = time.perf_counter() - start
+    logger.info(f"Model loaded in {load_time_s:.2f} s")
+
+    rng = np.random.default_rng(seed)
+    latencies = []
+    logger.info(f"Replaying {n_batches} batches of {batch_size} records")
+    for i in range(n_batches):
+        event = make_batch(rng, batch_size, first_ride_id=i * batch_size)
+        start = time.perf_counter()
+        lambda_function.lambda_handler(event, None)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies)
+    peak_mb = peak_rss_mb()
+    logger.info(f"Peak RSS: {peak_mb:.0f} MiB (before model load: {baseline_mb:.0f})")
+    logger.info(
+        "Batch latency: "
+        f"p50={np.percentile(latencies, 50):.3f} s, "
+        f"p99={np.percentile(latencies, 99):.3f} s, "
+        f"max={latencies.max():.3f} s"
+    )
+
+    memory_size = suggest_memory(peak_mb, memory_headroom)
+    timeout = suggest_timeout(latencies.max(), load_time_s, timeout_factor)
+    logger.info(f"Suggested memory_size={memory_size} MiB, timeout={timeout} s")
+
+    write_settings(memory_size, timeout, output_format, output_file)
+    logger.info(f"All done, settings written to {output_file}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
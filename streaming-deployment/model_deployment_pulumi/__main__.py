@@ -9,6 +9,9 @@ output_stream_name = config.require("output_stream_name")
 image_uri = config.require("image_uri")
 model_bucket = config.require("model_bucket")
 run_id = config.require("run_id")
+# Lambda sizing, see model_deployment/profile_lambda.py
+memory_size = config.get_int("memory_size") or 512
+timeout = config.get_int("timeout") or 700
 
 # Create the input Kinesis stream
 input_stream = aws_native.kinesis.Stream(
@@ -77,8 +80,8 @@ iam_role = aws_native.iam.Role(
 # Create the lambda function
 lambda_func = aws_native.lambda_.Function(
     "predict",
-    memory_size=512,
-    timeout=700,
+    memory_size=memory_size,
+    timeout=timeout,
     package_type="Image",
     code={"image_uri": image_uri},
     role=iam_role.arn,
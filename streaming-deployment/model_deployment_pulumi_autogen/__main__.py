@@ -19,6 +19,14 @@ model_bucket = config.require("modelBucket")
 # The Run ID for the model to use
 run_id = config.require("runId")
 lambda_function_name = config.require("lambdaFunctionName")
+# Lambda memory size, in MB
+memory_size = config.get_int("memorySize")
+if memory_size is None:
+    memory_size = 512
+# Lambda timeout, in seconds
+timeout = config.get_int("timeout")
+if timeout is None:
+    timeout = 700
 current_identity = aws.get_caller_identity_output()
 account_id = current_identity.account_id
 
@@ -62,6 +70,8 @@ lambda_function = Lambda(
         "outputStreamArn": output_stream_arn,
         "sourceStreamName": source_stream_name,
         "sourceStreamArn": source_stream_arn,
+        "memorySize": memory_size,
+        "timeout": timeout,
     },
 )
 pulumi.export("lambdaFunction", lambda_function_name)
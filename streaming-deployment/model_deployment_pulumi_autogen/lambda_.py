@@ -14,6 +14,8 @@ class LambdaArgs(TypedDict, total=False):
     runId: Input[str]
     lambdaFunctionName: Input[Any]
     imageUri: Input[Any]
+    memorySize: Input[int]
+    timeout: Input[int]
 
 
 class Lambda(pulumi.ComponentResource):
@@ -123,8 +125,8 @@ class Lambda(pulumi.ComponentResource):
                     "LOGGED_MODEL": f"s3://{args['modelBucket']}/1/{args['runId']}/artifacts/model",
                 },
             },
-            timeout=700,
-            memory_size=512,
+            timeout=args.get("timeout", 700),
+            memory_size=args.get("memorySize", 512),
             opts=pulumi.ResourceOptions(parent=self),
         )
 
@@ -50,6 +50,8 @@ module "lambda_function" {
   output_stream_arn    = module.output_kinesis_stream.stream_arn
   source_stream_name   = var.source_stream_name
   source_stream_arn    = module.source_kinesis_stream.stream_arn
+  memory_size          = var.lambda_memory_size
+  timeout              = var.lambda_timeout
 }
 
 # For CI/CD
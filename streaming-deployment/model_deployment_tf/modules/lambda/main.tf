@@ -14,8 +14,8 @@ resource "aws_lambda_function" "kinesis_lambda" {
       LOGGED_MODEL = "s3://${var.model_bucket}/1/${var.run_id}/artifacts/model"
     }
   }
-  timeout     = 700
-  memory_size = 512
+  timeout     = var.timeout
+  memory_size = var.memory_size
 }
 
 # Lambda Invoke & Event Source Mapping:
@@ -32,3 +32,13 @@ variable "lambda_function_name" {
 variable "image_uri" {
   description = "ECR image uri"
 }
+
+variable "memory_size" {
+  description = "Memory available to the lambda function, in MB"
+  default     = 512
+}
+
+variable "timeout" {
+  description = "Timeout of the lambda function, in seconds"
+  default     = 700
+}
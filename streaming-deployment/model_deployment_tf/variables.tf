@@ -36,3 +36,15 @@ variable "lambda_function_name" {
   description = ""
   type        = string
 }
+
+variable "lambda_memory_size" {
+  description = "Memory available to the lambda function, in MB"
+  default     = 512
+  type        = number
+}
+
+variable "lambda_timeout" {
+  description = "Timeout of the lambda function, in seconds"
+  default     = 700
+  type        = number
+}
@@ -0,0 +1,174 @@
+"""Minimal runtime for the compact tree ensemble exported by train_model.py.
+
+Only depends on numpy, so that it can be served from a slim image without
+scikit-learn, pandas or mlflow. The model is stored as two files:
+
+- model.npz: the flattened float32 trees
+- feature_index.json: maps the DictVectorizer feature names to columns
+"""
+
+import json
+import os
+from typing import Dict, List, Union
+
+import numpy as np
+
+MODEL_FILE = "model.npz"
+FEATURE_INDEX_FILE = "feature_index.json"
+# Rows pushed through the trees at once, bounds the size of the
+# (rows x trees) temporary arrays
+CHUNK_SIZE = 2000
+
+
+class CompactModel:
+    """A gradient boosted tree ensemble stored as flat arrays. All the trees
+    are concatenated, and every node is addressed by its global index.
+    Leaves point to themselves, so that every sample can be pushed down
+    all the trees at once for a fixed number of steps.
+    """
+
+    def __init__(
+        self,
+        init: float,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        depth: int,
+        feature_index: Dict[str, int],
+    ):
+        self.init = init
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.feature_index = feature_index
+
+    def transform(self, records: List[Dict[str, Union[str, float]]]) -> np.ndarray:
+        """Vectorize the features, the same way DictVectorizer does.
+        Features the trees never split on are dropped.
+
+        Args:
+            records (List[Dict[str, Union[str, float]]]): The input dicts
+
+        Returns:
+            np.ndarray: The feature matrix
+        """
+        X = np.zeros((len(records), len(self.feature_index)), dtype=np.float32)
+        for i, record in enumerate(records):
+            for key, value in record.items():
+                if isinstance(value, str):
+                    key, value = f"{key}={value}", 1.0
+                column = self.feature_index.get(key)
+                if column is not None:
+                    X[i, column] = value
+        return X
+
+    def predict(
+        self,
+        records: Union[
+            Dict[str, Union[str, float]], List[Dict[str, Union[str, float]]]
+        ],
+    ) -> np.ndarray:
+        """Predict the duration of the rides
+
+        Args:
+            records (Union[Dict, List[Dict]]): One or more input dicts
+
+        Returns:
+            np.ndarray: The predictions
+        """
+        if isinstance(records, dict):
+            records = [records]
+        return np.concatenate(
+            [
+                self._predict_chunk(records[start : start + CHUNK_SIZE])
+                for start in range(0, len(records), CHUNK_SIZE)
+            ]
+            or [np.zeros(0)]
+        )
+
+    def _predict_chunk(self, records: List[Dict[str, Union[str, float]]]) -> np.ndarray:
+        X = self.transform(records)
+        rows = np.arange(len(records))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(records), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.init + self.value[nodes].sum(axis=1, dtype=np.float64)
+
+    def save(self, path: str):
+        """Write the model to a directory
+
+        Args:
+            path (str): The output directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.savez_compressed(
+            os.path.join(path, MODEL_FILE),
+            init=np.float64(self.init),
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            roots=self.roots,
+            depth=np.int32(self.depth),
+        )
+        with open(os.path.join(path, FEATURE_INDEX_FILE), "w") as fw:
+            json.dump(self.feature_index, fw)
+
+
+def download_model(uri: str, path: str = "/tmp/compact_model") -> str:
+    """Download the model files from S3
+
+    Args:
+        uri (str): s3://bucket/prefix of the model directory
+        path (str): Local directory to download to
+
+    Returns:
+        str: The local directory
+    """
+    # boto3 is always available on Lambda
+    import boto3
+
+    bucket, _, prefix = uri[len("s3://") :].partition("/")
+    s3 = boto3.client("s3")
+    os.makedirs(path, exist_ok=True)
+    for name in (MODEL_FILE, FEATURE_INDEX_FILE):
+        s3.download_file(
+            bucket, f"{prefix.rstrip('/')}/{name}", os.path.join(path, name)
+        )
+    return path
+
+
+def load_model(uri: str) -> CompactModel:
+    """Load the model from a local directory or an s3:// URI
+
+    Args:
+        uri (str): Location of the model directory
+
+    Returns:
+        CompactModel: The model
+    """
+    path = download_model(uri) if uri.startswith("s3://") else uri
+    with np.load(os.path.join(path, MODEL_FILE)) as data:
+        arrays = {name: data[name] for name in data.files}
+    with open(os.path.join(path, FEATURE_INDEX_FILE)) as stream:
+        feature_index = json.load(stream)
+    return CompactModel(
+        init=float(arrays["init"]),
+        feature=arrays["feature"],
+        threshold=arrays["threshold"],
+        left=arrays["left"],
+        right=arrays["right"],
+        value=arrays["value"],
+        roots=arrays["roots"],
+        depth=int(arrays["depth"]),
+        feature_index=feature_index,
+    )
@@ -1,16 +1,23 @@
 import logging
-from typing import Dict, List, Union
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple, Union
 
 import mlflow
+import numpy as np
 import pandas as pd
 import pandera as pa
 import typer
+from compact_model import CompactModel, load_model
 from rich.logging import RichHandler
 from rich.traceback import install
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.metrics import root_mean_squared_error
-from sklearn.pipeline import make_pipeline
+from sklearn.pipeline import Pipeline, make_pipeline
 from typing_extensions import Annotated
 
 # Sets up the logger to work with rich
@@ -90,6 +97,246 @@ def prepare_dictionaries(df: pd.DataFrame) -> List[Dict[str, Union[str, float]]]
     return dicts
 
 
+def select_n_estimators(
+    pipeline: Pipeline,
+    dicts: List[Dict[str, Union[str, float]]],
+    y: np.ndarray,
+    tolerance: float,
+) -> int:
+    """Find the smallest number of boosting stages whose RMSE is within
+    a relative tolerance of the best RMSE over all the stages.
+
+    Args:
+        pipeline (Pipeline): The trained DictVectorizer + GBRT pipeline
+        dicts (List[Dict[str, Union[str, float]]]): Validation features
+        y (np.ndarray): Validation targets
+        tolerance (float): Allowed relative increase of the RMSE
+
+    Returns:
+        int: The number of stages to keep
+    """
+    dv, gbr = pipeline.steps[0][1], pipeline.steps[-1][1]
+    X = dv.transform(dicts)
+    rmses = np.array(
+        [root_mean_squared_error(y_pred, y) for y_pred in gbr.staged_predict(X)]
+    )
+    return int(np.argmax(rmses <= rmses.min() * (1 + tolerance))) + 1
+
+
+def round_down_float32(values: np.ndarray) -> np.ndarray:
+    """Convert to the largest float32 values that are <= the inputs.
+    sklearn compares float32 features with float64 thresholds, so
+    rounding a threshold up could send samples down the wrong branch.
+
+    Args:
+        values (np.ndarray): float64 values
+
+    Returns:
+        np.ndarray: float32 values
+    """
+    rounded = values.astype(np.float32)
+    return np.where(
+        rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded
+    )
+
+
+def export_compact_model(pipeline: Pipeline, n_estimators: int) -> CompactModel:
+    """Convert the first n_estimators trees of the pipeline into a
+    float32 CompactModel. The leaf values are pre-scaled by the learning
+    rate and the features the trees never split on are dropped.
+
+    Args:
+        pipeline (Pipeline): The trained DictVectorizer + GBRT pipeline
+        n_estimators (int): The number of stages to keep
+
+    Returns:
+        CompactModel: The compact model
+    """
+    dv, gbr = pipeline.steps[0][1], pipeline.steps[-1][1]
+    trees = [estimator[0].tree_ for estimator in gbr.estimators_[:n_estimators]]
+
+    # Only keep the features that are used in a split
+    used = np.unique(
+        np.concatenate([tree.feature[tree.feature >= 0] for tree in trees])
+    )
+    remap = np.zeros(len(dv.feature_names_), dtype=np.int32)
+    remap[used] = np.arange(len(used), dtype=np.int32)
+    names = dv.get_feature_names_out()
+    feature_index = {str(names[i]): int(remap[i]) for i in used}
+
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        nodes = np.arange(tree.node_count, dtype=np.int32) + offset
+        is_leaf = tree.children_left < 0
+        # Leaves point to themselves, splits to the remapped children
+        left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+        right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, remap[np.maximum(tree.feature, 0)]))
+        threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+        value.append(gbr.learning_rate * tree.value[:, 0, 0])
+        roots.append(offset)
+        offset += tree.node_count
+
+    return CompactModel(
+        init=float(gbr.init_.constant_[0][0]),
+        feature=np.concatenate(feature).astype(np.int32),
+        threshold=round_down_float32(np.concatenate(threshold)),
+        left=np.concatenate(left).astype(np.int32),
+        right=np.concatenate(right).astype(np.int32),
+        value=np.concatenate(value).astype(np.float32),
+        roots=np.array(roots, dtype=np.int32),
+        depth=max(tree.max_depth for tree in trees),
+        feature_index=feature_index,
+    )
+
+
+def check_parity(pipeline: Pipeline, dicts: List[Dict[str, Union[str, float]]]):
+    """Check that the export with all the boosting stages reproduces the
+    predictions of the pipeline, up to the float32 rounding of the
+    leaf values.
+
+    Args:
+        pipeline (Pipeline): The trained DictVectorizer + GBRT pipeline
+        dicts (List[Dict[str, Union[str, float]]]): Features to check on
+
+    Raises:
+        ValueError: If the predictions differ by more than the tolerance
+    """
+    gbr = pipeline.steps[-1][1]
+    compact = export_compact_model(pipeline, len(gbr.estimators_))
+    # Each leaf value is off by at most one float32 rounding
+    largest_leaves = np.maximum.reduceat(np.abs(compact.value), compact.roots)
+    tolerance = np.finfo(np.float32).eps * largest_leaves.astype(np.float64).sum()
+    max_diff = float(np.abs(compact.predict(dicts) - pipeline.predict(dicts)).max())
+    logger.info(f"Compact model parity: max diff {max_diff:.2e} (tol {tolerance:.2e})")
+    if max_diff > tolerance:
+        raise ValueError(
+            f"Compact model differs from the pipeline by {max_diff}, "
+            f"more than the tolerance {tolerance}"
+        )
+
+
+def directory_size_mb(path: str) -> float:
+    """Total size of the files in a directory, in MB"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size / 1024**2
+
+
+def build_compact_model(
+    pipeline: Pipeline,
+    dicts: List[Dict[str, Union[str, float]]],
+    y: np.ndarray,
+    prune_tolerance: float,
+) -> Tuple[CompactModel, np.ndarray]:
+    """Check the export against the pipeline and build a pruned, float32
+    version of the model for the slim image.
+
+    Half of the validation data is used to choose the number of boosting
+    stages, the other half is kept to report the accuracy.
+
+    Args:
+        pipeline (Pipeline): The trained DictVectorizer + GBRT pipeline
+        dicts (List[Dict[str, Union[str, float]]]): Validation features
+        y (np.ndarray): Validation targets
+        prune_tolerance (float): Allowed relative increase of the RMSE
+                                 when dropping boosting stages
+
+    Returns:
+        Tuple[CompactModel, np.ndarray]: The compact model and the indices
+                                         of the held-out validation rows
+
+    Raises:
+        ValueError: If the export does not reproduce the pipeline
+    """
+    check_parity(pipeline, dicts)
+
+    rng = np.random.default_rng(42)
+    indices = rng.permutation(len(dicts))
+    prune_idx, holdout_idx = np.array_split(indices, 2)
+
+    n_estimators = select_n_estimators(
+        pipeline, [dicts[i] for i in prune_idx], y[prune_idx], prune_tolerance
+    )
+    logger.info(f"Keeping {n_estimators} boosting stages in the compact model")
+    return export_compact_model(pipeline, n_estimators), holdout_idx
+
+
+def cold_load_time(code: str) -> float:
+    """Time loading a model in a fresh Python process, so that the
+    interpreter start-up and the imports are included, as on a Lambda
+    cold start.
+
+    Args:
+        code (str): Python code loading the model
+
+    Returns:
+        float: Wall-clock time of the process, in seconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def log_compact_model(
+    pipeline: Pipeline,
+    compact: CompactModel,
+    dicts: List[Dict[str, Union[str, float]]],
+    y: np.ndarray,
+):
+    """Log the compact model as the "compact_model" artifact, and log
+    how its size, cold load time and accuracy compare with the full model.
+
+    Args:
+        pipeline (Pipeline): The trained DictVectorizer + GBRT pipeline
+        compact (CompactModel): The compact model
+        dicts (List[Dict[str, Union[str, float]]]): Held-out features
+        y (np.ndarray): Held-out targets
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        full_path = os.path.join(tmp_dir, "model")
+        compact_path = os.path.join(tmp_dir, "compact_model")
+        mlflow.sklearn.save_model(pipeline, full_path)
+        compact.save(compact_path)
+
+        full_load_time = cold_load_time(
+            f"import mlflow; mlflow.pyfunc.load_model({full_path!r})"
+        )
+        runtime_dir = os.path.dirname(os.path.abspath(__file__))
+        compact_load_time = cold_load_time(
+            f"import sys; sys.path.insert(0, {runtime_dir!r}); "
+            f"from compact_model import load_model; load_model({compact_path!r})"
+        )
+
+        y_full = pipeline.predict(dicts)
+        y_compact = load_model(compact_path).predict(dicts)
+        full_rmse = root_mean_squared_error(y_full, y)
+        compact_rmse = root_mean_squared_error(y_compact, y)
+
+        mlflow.log_params(
+            {
+                "compact_n_estimators": len(compact.roots),
+                "compact_n_features": len(compact.feature_index),
+            }
+        )
+        mlflow.log_metrics(
+            {
+                "full_model_size_mb": directory_size_mb(full_path),
+                "compact_model_size_mb": directory_size_mb(compact_path),
+                "full_model_cold_load_time_s": full_load_time,
+                "compact_model_cold_load_time_s": compact_load_time,
+                "holdout_rmse": full_rmse,
+                "compact_holdout_rmse": compact_rmse,
+                "compact_holdout_rmse_delta": compact_rmse - full_rmse,
+                "compact_holdout_max_abs_diff": float(np.abs(y_compact - y_full).max()),
+            }
+        )
+        mlflow.log_artifacts(compact_path, artifact_path="compact_model")
+
+
 def main(
     tracking_uri: Annotated[
         str, typer.Option(help="The MLFlow tracking URI")
@@ -97,6 +344,13 @@ def main(
     experiment_name: Annotated[
         str, typer.Option(help="The experiment name to use")
     ] = "nyc-taxi-analysis",
+    compact_model: Annotated[
+        bool, typer.Option(help="Also log a compact, numpy-only model")
+    ] = True,
+    prune_tolerance: Annotated[
+        float,
+        typer.Option(help="Allowed relative RMSE increase when pruning stages"),
+    ] = 0.001,
 ):
     mlflow.set_tracking_uri(tracking_uri)
     mlflow.set_experiment(experiment_name)
@@ -129,8 +383,30 @@ def main(
         rmse = root_mean_squared_error(y_pred, y_val)
 
         mlflow.log_metric("rmse", rmse)
+
+        # Build the compact model before logging anything, a failed
+        # parity check only skips the compact artifact
+        compact = None
+        if compact_model:
+            logger.info("Building compact model")
+            try:
+                compact, holdout_idx = build_compact_model(
+                    pipeline, dict_val, y_val, prune_tolerance
+                )
+            except ValueError as exc:
+                logger.error(f"Skipping compact model: {exc}")
+                mlflow.set_tag("compact_model_error", str(exc))
+
         logger.info("Logging model artifact")
         mlflow.sklearn.log_model(pipeline, artifact_path="model")
+        if compact is not None:
+            logger.info("Logging compact model artifact")
+            log_compact_model(
+                pipeline,
+                compact,
+                [dict_val[i] for i in holdout_idx],
+                y_val[holdout_idx],
+            )
         logger.info("All done")
 
 